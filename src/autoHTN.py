@@ -1,28 +1,49 @@
 import pyhop
 import json
+import sys
 import time
 from typing import Dict, List, Tuple
 
+class CraftingState:
+    """Planning state with fixed slots for the time budget and inventory.
+    Slot access avoids the per-instance __dict__ that pyhop.State carries."""
+    __slots__ = ('__name__', 'time', 'inv')
+    
+    def __init__(self, name):
+        self.__name__ = name
+    
+    def __deepcopy__(self, memo):
+        # pyhop deep-copies the state before every operator; time is an int and
+        # inv holds only ints, so copying the one dict is a full deep copy
+        new = CraftingState(self.__name__)
+        new.time = self.time
+        new.inv = self.inv.copy()
+        return new
+
+# Task name that produces each item, filled in by declare_methods
+produce_tasks = {}
+
 # Basic helper functions for checking and producing items
 def check_enough(state, ID, item, num):
     """Check if we have enough of a specific item.
     Returns empty list if we have enough (success), False otherwise."""
-    if getattr(state, item)[ID] >= num: return []
-    return False
+    return [] if state.inv[item] >= num else False
 
 def produce_enough(state, ID, item, num):
     """Creates a sequence of tasks to produce an item and verify we have enough.
-    First produces the item, then checks if we have enough."""
-    return [('produce', ID, item), ('have_enough', ID, item, num)]
+    Goes straight to the item's recipe task, or returns False if nothing makes it."""
+    task_name = produce_tasks.get(item)
+    if task_name is None:
+        return False
+    return [(task_name, ID), ('have_enough', ID, item, num)]
 
 # Declare the basic methods to pyhop
 pyhop.declare_methods('have_enough', check_enough, produce_enough)
 
-def produce(state, ID, item):
-    """Creates a task to produce a specific item using its recipe."""
-    return [('produce_{}'.format(item), ID)]
-
-pyhop.declare_methods('produce', produce)
+# Generated methods and operators, keyed by id(rule). The rule is stored next
+# to its closure so the id cannot be reused while the entry is cached.
+method_cache = {}
+operator_cache = {}
 
 def make_method(name, rule):
     """Creates an HTN method for producing an item based on crafting rules.
@@ -31,58 +52,78 @@ def make_method(name, rule):
         name: Name of the recipe
         rule: Dictionary containing recipe requirements and outputs
     """
+    # Define priority order for gathering materials
+    order = ['bench', 'furnace', 'ingot', 'ore', 'coal', 'cobble', 'stick', 'plank', 'wood', 
+            'iron_axe', 'stone_axe', 'wooden_axe', 'iron_pickaxe', 'wooden_pickaxe', 'stone_pickaxe']
+    order_idx = {item: i for i, item in enumerate(order)}
+    
+    # Combine both required tools and consumed materials
+    needs = rule.get('Requires', {}) | rule.get('Consumes', {})
+    
+    # Sort items by their priority in the order list once, when the rule is registered
+    sorted_items = tuple(sorted(needs.items(), key=lambda x: order_idx.get(x[0], len(order))))
+    
+    # Name of the operator this method ends with
+    op_name = ("op_" + name).replace(' ', '_')
+    
     def method(state, ID):
-        # Define priority order for gathering materials
-        order = ['bench', 'furnace', 'ingot', 'ore', 'coal', 'cobble', 'stick', 'plank', 'wood', 
-                'iron_axe', 'stone_axe', 'wooden_axe', 'iron_pickaxe', 'wooden_pickaxe', 'stone_pickaxe']
-        
-        # Combine both required tools and consumed materials
-        needs = rule.get('Requires', {}) | rule.get('Consumes', {})
-        
         # Create list to store subtasks
         subtasks = []
         
-        # Sort items by their priority in the order list
-        items = sorted(needs.items(), key=lambda x: order.index(x[0]))
-        
         # Add subtask for each required item
-        for item, amount in items:
+        for item, amount in sorted_items:
             subtasks.append(('have_enough', ID, item, amount))
             
         # Finally, add the actual crafting operation
-        subtasks.append((("op_" + name).replace(' ', '_'), ID))
+        subtasks.append((op_name, ID))
         
         return subtasks
     return method
 
-def declare_methods(data):
+def sorted_recipes(data):
+    """Returns the recipes as (name, rule) pairs, fastest first.
+    
+    Args:
+        data: Dictionary containing all recipes and crafting rules
+    """
+    return sorted(data['Recipes'].items(), key=lambda r: r[1]['Time'])
+
+def declare_methods(data, recipes=None):
     """Declares all crafting methods to pyhop, sorted by time efficiency.
     
     Args:
         data: Dictionary containing all recipes and crafting rules
+        recipes: The result of sorted_recipes(data), if already computed
     """
+    if recipes is None:
+        recipes = sorted_recipes(data)
+    
     # Dictionary to store methods grouped by product
     methods = {}
     
-    # Process each recipe
-    for recipe_name, recipe_info in data['Recipes'].items():
-        cur_time = recipe_info['Time']
-        m = make_method(recipe_name, recipe_info)
-        m.__name__ = recipe_name.replace(' ', '_')
-        
-        # Get the product name from the recipe
-        cur_m = ("produce_" + list(recipe_info['Produces'].keys())[0]).replace(' ', '_')
+    # Process each recipe, faster recipes first
+    for recipe_name, recipe_info in recipes:
+        key = id(recipe_info)
+        if key not in method_cache:
+            m = make_method(recipe_name, recipe_info)
+            m.__name__ = recipe_name.replace(' ', '_')
+            
+            # Get the task name from the recipe's product
+            product = next(iter(recipe_info['Produces']))
+            task_name = ("produce_" + product).replace(' ', '_')
+            method_cache[key] = (recipe_info, m, product, task_name)
+        _, m, product, cur_m = method_cache[key]
+        produce_tasks[product] = cur_m
         
-        # Group methods by what they produce
+        # Group methods by what they produce; each group stays in time order
         if cur_m not in methods:
-            methods[cur_m] = [(m, cur_time)]
+            methods[cur_m] = [m]
         else:
-            methods[cur_m].append((m, cur_time))
+            methods[cur_m].append(m)
     
-    # Declare methods to pyhop, sorted by time (faster methods first)
+    # Declare methods to pyhop (faster methods first)
     for m, info in methods.items():
-        methods[m] = sorted(info, key=lambda x: x[1])
-        pyhop.declare_methods(m, *[method[0] for method in methods[m]])
+        pyhop.declare_methods(m, *info)
 
 def make_operator(rule):
     """Creates a pyhop operator that represents a primitive crafting action.
@@ -90,41 +131,39 @@ def make_operator(rule):
     Args:
         rule: Dictionary containing recipe requirements and effects
     """
-    def operator(state, ID):
-        # First check: Do we have enough time?
-        if state.time[ID] < rule['Time']:
-            return False
-            
-        # Second check: Do we have required tools?
-        if 'Requires' in rule:
-            for item, amount in rule['Requires'].items():
-                if getattr(state, item)[ID] < amount:
-                    return False
-                    
-        # Third check: Do we have materials to consume?
-        if 'Consumes' in rule:
-            for item, amount in rule['Consumes'].items():
-                if getattr(state, item)[ID] < amount:
-                    return False
-        
-        # If all checks pass, execute the crafting:
-        
-        # 1. Use up time
-        state.time[ID] -= rule['Time']
-        
-        # 2. Consume materials
-        if 'Consumes' in rule:
-            for item, amount in rule['Consumes'].items():
-                cur_val = getattr(state, item)
-                setattr(state, item, {ID: cur_val[ID] - amount})
-        
-        # 3. Produce new items
-        for item, amount in rule['Produces'].items():
-            cur_val = getattr(state, item)
-            setattr(state, item, {ID: cur_val[ID] + amount})
-            
-        return state
-    return operator
+    consumes = rule.get('Consumes', {})
+    rtime = rule['Time']
+    
+    # Required tools and consumed materials share one precondition pass;
+    # an item listed in both needs the larger of the two amounts
+    minimums = dict(rule.get('Requires', {}))
+    for item, amount in consumes.items():
+        minimums[item] = max(minimums.get(item, 0), amount)
+    minimums = tuple(minimums.items())
+    
+    # Consuming and producing collapse into one net change per item
+    deltas = {item: -amount for item, amount in consumes.items()}
+    for item, amount in rule['Produces'].items():
+        deltas[item] = deltas.get(item, 0) + amount
+    deltas = tuple((item, delta) for item, delta in deltas.items() if delta)
+    
+    # Generate straight-line source specialised to this rule: the items and
+    # amounts become literals, so the operator runs no loops
+    conditions = ['state.time < {!r}'.format(rtime)]
+    conditions += ['inv[{!r}] < {!r}'.format(item, amount) for item, amount in minimums]
+    lines = ['def operator(state, ID):',
+             '    inv = state.inv',
+             # Check time, required tools and materials
+             '    if {}:'.format(' or '.join(conditions)),
+             '        return False',
+             # Use up time, consume materials and produce new items
+             '    state.time -= {!r}'.format(rtime)]
+    lines += ['    inv[{!r}] += {!r}'.format(item, delta) for item, delta in deltas]
+    lines.append('    return state')
+    
+    namespace = {}
+    exec(compile('\n'.join(lines), '<operator>', 'exec'), namespace)
+    return namespace['operator']
 
 def declare_operators(data):
     """Creates and declares all operators to pyhop based on recipes.
@@ -134,11 +173,55 @@ def declare_operators(data):
     """
     ops = []
     for recipe_name, recipe_info in data['Recipes'].items():
-        op = make_operator(recipe_info)
-        op.__name__ = ("op_" + recipe_name).replace(' ', '_')
+        key = id(recipe_info)
+        if key not in operator_cache:
+            op = make_operator(recipe_info)
+            op.__name__ = ("op_" + recipe_name).replace(' ', '_')
+            operator_cache[key] = (recipe_info, op)
+        op = operator_cache[key][1]
         ops.append(op)
     pyhop.declare_operators(*ops)
 
+def make_time_bound(data):
+    """Creates a function giving a lower bound on the time needed to have num of an item.
+    Required tools are ignored and recipe batches are treated as divisible. The
+    bound only recurses into a product's materials when all of its recipes consume
+    the same materials per unit; otherwise mixing recipes could draw on several
+    stocks, so only the product's own crafting time is counted.
+    
+    Args:
+        data: Dictionary containing all recipes and crafting rules
+    """
+    # For each product, the per-unit time and materials of every recipe making it
+    options = {}
+    for rule in data['Recipes'].values():
+        for product, made in rule['Produces'].items():
+            materials = {item: amount / made for item, amount in rule.get('Consumes', {}).items()}
+            options.setdefault(product, []).append((rule['Time'] / made, materials))
+    
+    # Collapse each product to its fastest per-unit time and, when every recipe
+    # agrees on them, its per-unit materials
+    per_unit = {}
+    for product, recipes in options.items():
+        unit_time = min(recipe_time for recipe_time, _ in recipes)
+        materials = recipes[0][1]
+        if any(other != materials for _, other in recipes):
+            materials = {}
+        per_unit[product] = (unit_time, tuple(materials.items()))
+    
+    def time_bound(inv, item, num, seen=()):
+        missing = num - inv[item]
+        if missing <= 0 or item in seen:
+            return 0
+        if item not in per_unit:
+            return float('inf')
+        unit_time, materials = per_unit[item]
+        seen += (item,)
+        return missing * unit_time + sum(time_bound(inv, material, amount * missing, seen)
+                                         for material, amount in materials)
+    
+    return time_bound
+
 def add_heuristic(data, ID):
     """Adds search optimization heuristics to pyhop.
     Returns True to prune a search branch, False to continue exploring.
@@ -147,34 +230,111 @@ def add_heuristic(data, ID):
         data: Dictionary containing crafting rules
         ID: Agent identifier
     """
+    # data never changes during planning, so decide these once up front
+    tools_set = frozenset(data['Tools'])
+    goal_set = frozenset(data['Goal'])
+    axe_in_goal = 'wooden_axe' in goal_set
+    stone_pickaxe_in_goal = 'stone_pickaxe' in goal_set
+    tool_tasks = {'produce_' + tool: tool for tool in tools_set}
+    time_bound = make_time_bound(data)
+    # Lower bounds per inventory: tuple(inv.values()) -> {(item, num): bound}
+    bound_cache = {}
+    
+    def pending(tasks, item):
+        # Total amount of item still requested by have_enough tasks
+        return sum(task[3] for task in tasks if len(task) > 3 and task[2] == item)
+    
     def heuristic(state, curr_task, tasks, plan, depth, calling_stack):
+        task_name = curr_task[0]
+        
         # 1. Prevent duplicate tool creation
-        if curr_task[0] == 'produce' and curr_task[2] in data['Tools']:
-            if getattr(state, curr_task[2])[ID] > 0:
-                return True
+        tool = tool_tasks.get(task_name)
+        if tool is not None and state.inv[tool] > 0:
+            return True
                 
         # 2. Optimize wood gathering (don't make axe unless needed)
-        if curr_task[0] == 'produce_wooden_axe':
-            wood_needed = sum([task[3] for task in tasks if len(task) > 3 and task[2] == 'wood'])
-            if wood_needed < 5 and 'wooden_axe' not in data['Goal']:
+        if task_name == 'produce_wooden_axe' and not axe_in_goal:
+            if pending(tasks, 'wood') < 5:
                 return True
                 
         # 3. Optimize stone pickaxe creation
-        if curr_task[0] == 'produce_stone_pickaxe':
-            if 'stone_pickaxe' not in data['Goal']:
-                cobble_needed = sum([task[3] for task in tasks if len(task) > 3 and task[2] == 'cobble'])
-                if cobble_needed < 5:
-                    return True
+        if task_name == 'produce_stone_pickaxe' and not stone_pickaxe_in_goal:
+            if pending(tasks, 'cobble') < 5:
+                return True
                     
         # 4. Prevent infinite cycles in tool requirements
-        if curr_task[0] == 'have_enough' and curr_task[2] in data['Tools']:
+        if task_name == 'have_enough' and curr_task[2] in tools_set:
             if tasks.count(curr_task) > 1:
                 return True
+        
+        # 5. Prune when the current task or a goal at the bottom of the task
+        # stack cannot be reached in the remaining time, checked only where the
+        # current task still needs production
+        if task_name == 'have_enough' and state.inv[curr_task[2]] < curr_task[3]:
+            inv = state.inv
+            # Bounds depend only on the inventory, which many nodes share
+            inv_key = tuple(inv.values())
+            bounds = bound_cache.get(inv_key)
+            if bounds is None:
+                if len(bound_cache) >= 10000:
+                    bound_cache.clear()
+                bounds = bound_cache[inv_key] = {}
+            # Small tolerance so float rounding never prunes an exact fit
+            time_left = state.time + 1e-9
+            
+            # The goals are the run of have_enough tasks that ends the stack
+            needs = {curr_task[2:4]}
+            for task in reversed(tasks):
+                if task[0] != 'have_enough':
+                    break
+                needs.add(task[2:4])
+            
+            for need in needs:
+                need_bound = bounds.get(need)
+                if need_bound is None:
+                    need_bound = bounds[need] = time_bound(inv, *need)
+                if need_bound > time_left:
+                    return True
                 
         return False
     
     pyhop.add_check(heuristic)
 
+def subproblem_key(state, tasks):
+    """Identifies a planning subproblem for pyhop's memo of failed searches.
+    The heuristic only looks at the state and pending tasks, so two nodes with the
+    same time, inventory and tasks always succeed or fail together. The key is one
+    flat tuple; every inventory has the same items, so the fields never shift."""
+    return (state.time, *state.inv.values(), *tasks)
+
+def load_data(path):
+    """Load crafting rules from a JSON file.
+    Every item, tool and recipe name is interned so lookups keyed by them
+    compare by identity.
+    
+    Args:
+        path: Path to the crafting rules JSON file
+    """
+    with open(path) as f:
+        data = json.load(f)
+    
+    def intern_keys(amounts):
+        return {sys.intern(item): amount for item, amount in amounts.items()}
+    
+    data['Items'] = [sys.intern(item) for item in data['Items']]
+    data['Tools'] = [sys.intern(tool) for tool in data['Tools']]
+    data['Initial'] = intern_keys(data['Initial'])
+    data['Goal'] = intern_keys(data['Goal'])
+    
+    recipes = {}
+    for name, rule in data['Recipes'].items():
+        for part in ('Produces', 'Requires', 'Consumes'):
+            if part in rule:
+                rule[part] = intern_keys(rule[part])
+        recipes[sys.intern(name)] = rule
+    data['Recipes'] = recipes
+    return data
+
 def set_up_state(data, test_case, ID, time=0):
     """Initialize the game state with items, tools, and initial resources.
     
@@ -184,18 +344,14 @@ def set_up_state(data, test_case, ID, time=0):
         ID: Agent identifier
         time: Time limit for crafting
     """
-    state = pyhop.State('state')
-    state.time = {ID: time}
+    state = CraftingState('state')
+    state.time = time
     
-    # Initialize everything to zero first
-    for item in data['Items']:
-        setattr(state, item, {ID: 0})
-    for item in data['Tools']:
-        setattr(state, item, {ID: 0})
+    # Single inventory dict keyed by item name; everything starts at zero
+    state.inv = {item: 0 for item in data['Items'] + data['Tools']}
     
     # Set initial quantities from test case
-    for item, num in test_case['Initial'].items():
-        setattr(state, item, {ID: num})
+    state.inv.update(test_case['Initial'])
             
     return state
 
@@ -221,8 +377,8 @@ def main():
     }
     
     # Load crafting rules
-    with open('crafting.json') as f:
-        data = json.load(f)
+    data = load_data('crafting.json')
+    recipes = sorted_recipes(data)
         
     # Run each test case
     for case_name, test_case in test_cases.items():
@@ -234,8 +390,10 @@ def main():
         
         # Reset planner for each test case
         declare_operators(data)
-        declare_methods(data)
+        declare_methods(data, recipes)
+        pyhop.checks.clear()
         add_heuristic(data, 'agent')
+        pyhop.set_memo_key(subproblem_key)
         
         # Print problem details
         print(f"Initial State: {test_case['Initial']}")
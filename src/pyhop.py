@@ -97,6 +97,7 @@ Pyhop provides the following classes and functions:
 
 from __future__ import print_function
 import copy,sys, pprint
+from itertools import islice # cm146 modification
 
 ############################################################
 # States and goals
@@ -112,12 +113,20 @@ class Goal():
         self.__name__ = name
 
 
+# start cm146 modification
+def state_vars(state):
+    """Like vars(state), but also works for states that declare __slots__."""
+    if hasattr(state, '__dict__'):
+        return vars(state)
+    return {name: getattr(state, name) for name in type(state).__slots__}
+# end cm146 modification
+
 ### print_state and print_goal are identical except for the name
 
 def print_state(state,indent=4):
     """Print each variable in state, indented by indent spaces."""
     if state != False:
-        for (name,val) in vars(state).items():
+        for (name,val) in state_vars(state).items():
             if name != '__name__':
                 for x in range(indent): sys.stdout.write(' ')
                 sys.stdout.write(state.__name__ + '.' + name)
@@ -179,6 +188,18 @@ def declare_methods(task_name, *method_list):
 checks = []
 def add_check(func):
     checks.append(func)
+
+# Subproblems already known to fail, identified by memo_key(state, tasks).
+# Only sound when the checks depend on nothing but state and tasks. failed is
+# a dict used as an insertion-ordered set; when it reaches failed_limit keys
+# the older half is forgotten, to bound its memory.
+memo_key = None
+failed = {}
+failed_limit = 1000000
+def set_memo_key(func):
+    global memo_key
+    memo_key = func
+    failed.clear()
 # end cm146 modification
 
 ############################################################
@@ -203,23 +224,58 @@ def pyhop(state,tasks,verbose=0):
     If successful, return the plan. Otherwise return False.
     """
     if verbose>0: print('** pyhop, verbose={}: **\n   state = {}\n   tasks = {}'.format(verbose, state.__name__, tasks))
+    failed.clear() # cm146 modification
     result = seek_plan(state,tasks,[],0,verbose)
+    failed.clear() # cm146 modification
     if verbose>0: print('** result =',result,'\n')
     return result
 
 # cm146 modification: add calling stack as parameter
+# cm146 modification: search iteratively with an explicit stack of nodes
+# instead of recursing, so deep plans don't hit Python's recursion limit
 def seek_plan(state,tasks,plan,depth,verbose=0,calling_stack=[]):
     """
     Workhorse for pyhop. state and tasks are as in pyhop.
     - plan is the current partial plan.
-    - depth is the recursion depth, for use in debugging
+    - depth is the search depth, for use in debugging
     - verbose is whether to print debugging messages
-    # """
-    # print (tasks)
-    if verbose>1: print('depth {} tasks {}'.format(depth,tasks))
-    if tasks == []:
-        if verbose>2: print('depth {} returns plan {}'.format(depth,plan))
-        return plan
+    """
+    stack = []
+    node = (state,tasks,plan,depth,calling_stack)
+    while True:
+        if node is not None:
+            state,tasks,plan,depth,calling_stack = node
+            if verbose>1: print('depth {} tasks {}'.format(depth,tasks))
+            if tasks == []:
+                if verbose>2: print('depth {} returns plan {}'.format(depth,plan))
+                return plan
+            key = None
+            if memo_key is not None:
+                key = memo_key(state, tasks)
+            if key is not None and key in failed:
+                if verbose>2: print('depth {} already failed'.format(depth))
+            else:
+                stack.append((seek_successors(state,tasks,plan,depth,verbose,calling_stack), key))
+        if not stack:
+            return False
+        successors, key = stack[-1]
+        node = next(successors, None)
+        if node is None:
+            # every way of accomplishing this node's tasks failed
+            stack.pop()
+            if key is not None:
+                if len(failed) >= failed_limit:
+                    # depth-first search mostly revisits recent failures
+                    for old in list(islice(failed, failed_limit // 2)):
+                        del failed[old]
+                failed[key] = True
+
+def seek_successors(state,tasks,plan,depth,verbose=0,calling_stack=[]):
+    """
+    Generate, in the order seek_plan should try them, the nodes that follow
+    from accomplishing the first of tasks in state. Each node is a tuple
+    (state, tasks, plan, depth, calling_stack).
+    """
     task1 = tasks[0]
 
     if task1[0] in operators:
@@ -230,14 +286,12 @@ def seek_plan(state,tasks,plan,depth,verbose=0,calling_stack=[]):
             print('depth {} new state:'.format(depth))
             print_state(newstate)
         if newstate:
-            solution = seek_plan(newstate,tasks[1:],plan+[task1],depth+1,verbose,calling_stack)
-            if solution != False:
-                return solution
+            yield (newstate,tasks[1:],plan+[task1],depth+1,calling_stack)
 
     # start cm146 modification
     for check in checks:
         if check(state, task1, tasks, plan, depth, calling_stack):
-            return False
+            return
     # end cm146 modification
 
     if task1[0] in methods:
@@ -249,8 +303,5 @@ def seek_plan(state,tasks,plan,depth,verbose=0,calling_stack=[]):
             if verbose>2:
                 print('depth {} new tasks: {}'.format(depth,subtasks))
             if subtasks != False:
-                solution = seek_plan(state,subtasks+tasks[1:],plan,depth+1,verbose,calling_stack+[task1])
-                if solution != False:
-                    return solution
+                yield (state,subtasks+tasks[1:],plan,depth+1,calling_stack+[task1])
     if verbose>2: print('depth {} returns failure'.format(depth))
-    return False